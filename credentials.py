@@ -13,25 +13,47 @@ Returns:
 """
 
 import os
-import glob
+
+# (path, Credentials) resolved once per process — both the BigQuery and the
+# Data Transfer clients share the same object and therefore one token cache.
+_CACHED = None
+
+# Resolved key path, memoized so repeated calls skip the directory scan.
+_RESOLVED_PATH = None
 
 
 def load_credentials() -> str:
     """Resolve, set, and return the path to the Service Account JSON key."""
+    global _RESOLVED_PATH
+
+    if _RESOLVED_PATH:
+        return _RESOLVED_PATH
 
     # 1. Already explicitly set — respect it and do nothing.
     if os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"):
         path = os.environ["GOOGLE_APPLICATION_CREDENTIALS"]
         print(f"[auth] Using credentials from environment: {path}")
+        _RESOLVED_PATH = path
         return path
 
-    # 2. Auto-discover any .json file inside credentials/
-    matches = glob.glob("credentials/*.json")
+    # 2. Auto-discover any .json file inside credentials/ — exactly one key
+    #    is the expected case, so stop scanning at the second match.
+    matches = []
+    try:
+        with os.scandir("credentials") as entries:
+            for entry in entries:
+                if entry.name.endswith(".json") and entry.is_file():
+                    matches.append(entry.path)
+                    if len(matches) > 1:
+                        break
+    except FileNotFoundError:
+        pass
 
     if len(matches) == 1:
         path = os.path.abspath(matches[0])
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = path
         print(f"[auth] Service Account key auto-discovered: {path}")
+        _RESOLVED_PATH = path
         return path
 
     if len(matches) > 1:
@@ -49,3 +71,24 @@ def load_credentials() -> str:
         "  B) Set GOOGLE_APPLICATION_CREDENTIALS=/path/to/key.json in your .env file.\n"
         "Download your key at: GCP Console → IAM → Service Accounts → Keys."
     )
+
+
+def get_credentials():
+    """Return a Credentials object built from the resolved key, cached per process.
+
+    Passing this object to every GCP client avoids each client re-reading and
+    re-parsing the key file and performing its own initial token exchange.
+    """
+    global _CACHED
+
+    path = load_credentials()
+    if _CACHED is not None and _CACHED[0] == path:
+        return _CACHED[1]
+
+    from google.oauth2 import service_account
+
+    creds = service_account.Credentials.from_service_account_file(
+        path, scopes=["https://www.googleapis.com/auth/cloud-platform"]
+    )
+    _CACHED = (path, creds)
+    return creds
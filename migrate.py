@@ -7,22 +7,25 @@ Usage:
     python migrate.py --project my-project --dataset my_dataset --location us-east1 --status
 """
 
+from __future__ import annotations
+
 import os
-import glob
 import hashlib
+import json
 import time
 import re
+import string
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
 
 import click
-from dotenv import load_dotenv
-from google.cloud import bigquery
-from google.cloud import bigquery_datatransfer_v1
-from google.protobuf.struct_pb2 import Struct
 
-from credentials import load_credentials
+from credentials import get_credentials
 
-# Load .env before anything else (CLI args take precedence via click defaults)
-load_dotenv()
+# google.cloud.bigquery (and friends) pull in gRPC, protobuf and auth —
+# several hundred ms of import time. They are imported lazily inside the
+# functions that need them so --dry-run / --help stay snappy.
 
 # ---------------------------------------------------------------------------
 # Constants
@@ -30,6 +33,7 @@ load_dotenv()
 
 MIGRATIONS_DIR = "migrations"
 CONTROL_TABLE = "schema_migrations"
+CHECKSUM_CACHE_FILE = os.path.join(MIGRATIONS_DIR, ".cache.json")
 
 CREATE_CONTROL_TABLE_SQL = """
 CREATE TABLE IF NOT EXISTS `{project}.{dataset}.schema_migrations` (
@@ -46,38 +50,103 @@ CREATE TABLE IF NOT EXISTS `{project}.{dataset}.schema_migrations` (
 # Helpers
 # ---------------------------------------------------------------------------
 
-def sha256(content: str) -> str:
-    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+# Compiled once at import — these fire for every file scanned per invocation.
+_VERSION_RE = re.compile(r"^(V\d+)_")
+_HEADER_RE = re.compile(r"^--\s*@(\w+):\s*(.+)$")
+
+
+def sha256(content: str | bytes) -> str:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
 
 
+@lru_cache(maxsize=4096)
 def extract_version(filename: str) -> str:
-    """Extract version token from filename, e.g. 'V00001' from 'V00001_create_foo.sql'."""
+    """Extract version token from filename, e.g. 'V00001' from 'V00001_create_foo.sql'.
+
+    Memoized — the same paths are re-parsed by run_migrations, show_status
+    and the orphan-detection loop within one invocation.
+    """
     basename = os.path.basename(filename)
-    match = re.match(r"^(V\d+)_", basename)
+    match = _VERSION_RE.match(basename)
     if not match:
         raise ValueError(f"Invalid migration filename format: {basename!r}. Expected: V00001_description.sql")
     return match.group(1)
 
 
 def substitute_placeholders(sql: str, project: str, dataset: str) -> str:
-    return sql.replace("${PROJECT}", project).replace("${DATASET}", dataset)
+    # Fast path: most plain DDL scripts carry no placeholders at all. Check
+    # for the full "${" opener so a stray $ in a string literal or comment
+    # doesn't force the Template pass.
+    if "${" not in sql:
+        return sql
+    # Template.safe_substitute resolves all ${...} placeholders in one scan
+    # and leaves unknown ones untouched.
+    return string.Template(sql).safe_substitute(PROJECT=project, DATASET=dataset)
 
 
 def is_scheduled(sql: str) -> bool:
     """Return True if the script starts with the -- @scheduled marker."""
-    return sql.lstrip().startswith("-- @scheduled")
+    # Index-based scan: lstrip() would copy the entire script just to
+    # check a prefix, and this runs for every file in a migration pass.
+    i = 0
+    n = len(sql)
+    while i < n and sql[i] in " \t\r\n":
+        i += 1
+    return sql.startswith("-- @scheduled", i)
+
+
+def _strip_leading_comments(sql: str) -> str:
+    """Drop the leading comment/blank lines from a script in a single scan.
+
+    Used to remove the -- @scheduled header block before the SQL body is
+    handed to the Data Transfer Service. Walks line starts with str.find
+    instead of materializing every line via splitlines().
+    """
+    pos = 0
+    n = len(sql)
+    while pos < n:
+        i = pos
+        while i < n and sql[i] in " \t\r":
+            i += 1
+        if i >= n:
+            break
+        if sql[i] == "\n":  # blank line
+            pos = i + 1
+            continue
+        if sql.startswith("--", i):
+            nl = sql.find("\n", i)
+            if nl == -1:
+                return ""
+            pos = nl + 1
+            continue
+        break
+    return sql[pos:].strip()
 
 
 def parse_scheduled_metadata(sql: str) -> dict:
-    """Parse -- @key: value header lines from a scheduled script."""
+    """Parse -- @key: value header lines from a scheduled script.
+
+    The header occupies the first few lines only, so walk line starts with
+    str.find and stop at the first non-comment line instead of splitting
+    the whole file into a line list.
+    """
     meta = {}
-    for line in sql.splitlines():
-        line = line.strip()
+    pos = 0
+    n = len(sql)
+    while pos < n:
+        nl = sql.find("\n", pos)
+        end = n if nl == -1 else nl
+        line = sql[pos:end].strip()
         if not line.startswith("--"):
             break
-        match = re.match(r"^--\s*@(\w+):\s*(.+)$", line)
+        match = _HEADER_RE.match(line)
         if match:
             meta[match.group(1)] = match.group(2).strip()
+        if nl == -1:
+            break
+        pos = nl + 1
     return meta
 
 
@@ -90,33 +159,67 @@ def ensure_control_table(client: bigquery.Client, project: str, dataset: str) ->
     client.query(sql).result()
 
 
-def get_executed_versions(client: bigquery.Client, project: str, dataset: str) -> set:
-    """Return a set of versions that were successfully executed."""
+def get_executed_versions(
+    client: bigquery.Client,
+    project: str,
+    dataset: str,
+    cache: dict | None = None,
+) -> set:
+    """Return a set of versions that were successfully executed.
+
+    When the sidecar cache is provided, previously seen versions are read
+    from it and only rows newer than the cached executed_at watermark are
+    fetched, so repeat invocations stop re-scanning the full history.
+    """
+    from google.cloud import bigquery
+
+    # Successful versions are append-only, so caching them is safe; the
+    # entry is keyed per target to keep multi-dataset use correct.
+    state_key = f"_executed:{project}.{dataset}"
+    state = cache.get(state_key) if cache is not None else None
+    versions = set(state["versions"]) if state else set()
+    watermark = state.get("watermark") if state else None
+
     sql = f"""
-        SELECT version
+        SELECT version, executed_at
         FROM `{project}.{dataset}.{CONTROL_TABLE}`
         WHERE success = TRUE
     """
+    params = []
+    if watermark:
+        # >= plus the set union keeps rows sharing the watermark timestamp safe.
+        sql += " AND executed_at >= @last_seen"
+        params.append(bigquery.ScalarQueryParameter("last_seen", "TIMESTAMP", watermark))
+    job_config = bigquery.QueryJobConfig(use_query_cache=True, query_parameters=params)
+
     try:
-        rows = client.query(sql).result()
-        return {row.version for row in rows}
+        rows = list(client.query(sql, job_config=job_config).result())
     except Exception:
         # Table may not exist yet on first run — will be created by ensure_control_table
-        return set()
+        return versions
+
+    versions.update(row.version for row in rows)
+    if cache is not None:
+        timestamps = [row.executed_at for row in rows if row.executed_at is not None]
+        if timestamps:
+            watermark = max(timestamps).isoformat()
+        cache[state_key] = {"versions": sorted(versions), "watermark": watermark}
+    return versions
+
+
+# Control-table rows buffered during a run and flushed in one insert call.
+_PENDING_RECORDS: list[dict] = []
 
 
 def record_migration(
-    client: bigquery.Client,
-    project: str,
-    dataset: str,
     version: str,
     script_name: str,
     checksum: str,
     execution_time_ms: int,
     success: bool,
 ) -> None:
-    table_id = f"{project}.{dataset}.{CONTROL_TABLE}"
-    rows = [
+    """Buffer a control-table row; flush_migration_records() sends the batch."""
+    _PENDING_RECORDS.append(
         {
             "version": version,
             "script_name": script_name,
@@ -124,10 +227,44 @@ def record_migration(
             "execution_time_ms": execution_time_ms,
             "success": success,
         }
-    ]
-    errors = client.insert_rows_json(table_id, rows)
-    if errors:
-        raise RuntimeError(f"Failed to record migration {version}: {errors}")
+    )
+
+
+def flush_migration_records(client: bigquery.Client, project: str, dataset: str) -> None:
+    """Insert all buffered control-table rows with one parameterized DML statement.
+
+    DML avoids the streaming API entirely: no per-row round-trips, no
+    streaming-buffer lag before rows are queryable, so --status reflects a
+    just-finished run immediately.
+    """
+    if not _PENDING_RECORDS:
+        return
+
+    from google.cloud import bigquery
+
+    values = []
+    params = []
+    for i, rec in enumerate(_PENDING_RECORDS):
+        values.append(
+            f"(@version_{i}, @script_name_{i}, @checksum_{i}, "
+            f"CURRENT_TIMESTAMP(), @execution_time_ms_{i}, @success_{i})"
+        )
+        params.extend([
+            bigquery.ScalarQueryParameter(f"version_{i}", "STRING", rec["version"]),
+            bigquery.ScalarQueryParameter(f"script_name_{i}", "STRING", rec["script_name"]),
+            bigquery.ScalarQueryParameter(f"checksum_{i}", "STRING", rec["checksum"]),
+            bigquery.ScalarQueryParameter(f"execution_time_ms_{i}", "INT64", rec["execution_time_ms"]),
+            bigquery.ScalarQueryParameter(f"success_{i}", "BOOL", rec["success"]),
+        ])
+
+    sql = (
+        f"INSERT INTO `{project}.{dataset}.{CONTROL_TABLE}` "
+        "(version, script_name, checksum, executed_at, execution_time_ms, success) "
+        f"VALUES {', '.join(values)}"
+    )
+    job_config = bigquery.QueryJobConfig(query_parameters=params)
+    client.query(sql, job_config=job_config).result()
+    _PENDING_RECORDS.clear()
 
 
 def run_sql(client: bigquery.Client, sql: str, script_name: str) -> int:
@@ -140,6 +277,7 @@ def run_sql(client: bigquery.Client, sql: str, script_name: str) -> int:
 
 
 def deploy_scheduled_query(
+    dt_client,
     project: str,
     dataset: str,
     location: str,
@@ -149,8 +287,10 @@ def deploy_scheduled_query(
     script_name: str,
 ) -> None:
     """Create a BigQuery scheduled query via Data Transfer Service."""
+    from google.cloud import bigquery_datatransfer_v1
+    from google.protobuf.struct_pb2 import Struct
+
     click.echo(f"  Creating scheduled query '{display_name}' ...")
-    dt_client = bigquery_datatransfer_v1.DataTransferServiceClient()
     parent = f"projects/{project}/locations/{location}"
 
     params = Struct()
@@ -173,9 +313,61 @@ def deploy_scheduled_query(
 # Core migration logic
 # ---------------------------------------------------------------------------
 
+def _checksum_cache_load() -> dict:
+    """Load the sidecar cache (checksums + executed-version state); missing
+    or corrupt files mean empty."""
+    try:
+        with open(CHECKSUM_CACHE_FILE, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _checksum_cache_save(cache: dict) -> None:
+    try:
+        with open(CHECKSUM_CACHE_FILE, "w", encoding="utf-8") as fh:
+            json.dump(cache, fh)
+    except OSError:
+        # The cache is purely an optimization — never fail a run over it.
+        pass
+
+
+def load_script(file_path: str, project: str, dataset: str, cache: dict) -> tuple[str, str, str]:
+    """Read a migration file and return (raw_sql, checksum, substituted_sql).
+
+    Checksums are memoized in the sidecar cache keyed by (mtime_ns, size),
+    so unchanged files skip the SHA-256 pass on subsequent runs.
+    """
+    st = os.stat(file_path)
+    # Read bytes once: hash them directly (no utf-8 re-encode) and decode
+    # a single time for substitution.
+    raw_bytes = Path(file_path).read_bytes()
+
+    key = os.path.basename(file_path)
+    entry = cache.get(key)
+    if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+        checksum = entry[2]
+    else:
+        checksum = sha256(raw_bytes)
+        cache[key] = [st.st_mtime_ns, st.st_size, checksum]
+
+    raw_sql = raw_bytes.decode("utf-8")
+    return raw_sql, checksum, substitute_placeholders(raw_sql, project, dataset)
+
+
 def collect_migration_files() -> list[str]:
-    files = sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "V*.sql")))
-    return files
+    # os.scandir gives each entry's stat from the directory read itself —
+    # no per-file stat round and no fnmatch pattern machinery like glob.
+    try:
+        entries = os.scandir(MIGRATIONS_DIR)
+    except FileNotFoundError:
+        return []
+    with entries:
+        return sorted(
+            e.path
+            for e in entries
+            if e.name.startswith("V") and e.name.endswith(".sql") and e.is_file(follow_symlinks=False)
+        )
 
 
 def run_migrations(
@@ -198,13 +390,16 @@ def run_migrations(
         click.echo("\n[dry-run] No changes applied.")
         return
 
+    cache = _checksum_cache_load()
+
     ensure_control_table(client, project, dataset)
-    executed = get_executed_versions(client, project, dataset)
+    executed = get_executed_versions(client, project, dataset, cache)
 
     pending = [f for f in files if extract_version(f) not in executed]
 
     if not pending:
         click.echo("All migrations are already applied. Nothing to do.")
+        _checksum_cache_save(cache)
         return
 
     click.echo(f"Found {len(pending)} pending migration(s):")
@@ -212,56 +407,142 @@ def run_migrations(
         click.echo(f"  → {os.path.basename(f)}")
 
     click.echo("")
-    for file_path in pending:
-        version = extract_version(file_path)
-        script_name = os.path.basename(file_path)
+    # Migrations must run strictly in order, but the *next* file can be read
+    # and substituted while the current BigQuery job is executing.
+    scheduled: list[dict] = []
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            next_script = pool.submit(load_script, pending[0], project, dataset, cache)
+            for i, file_path in enumerate(pending):
+                version = extract_version(file_path)
+                script_name = os.path.basename(file_path)
+
+                raw_sql, checksum, sql = next_script.result()
+                if i + 1 < len(pending):
+                    next_script = pool.submit(load_script, pending[i + 1], project, dataset, cache)
+
+                if is_scheduled(raw_sql):
+                    # Scheduled queries only register transfer configs — they
+                    # don't mutate dataset state later migrations depend on —
+                    # so they are deferred and deployed concurrently below.
+                    meta = parse_scheduled_metadata(raw_sql)
+                    scheduled.append({
+                        "version": version,
+                        "script_name": script_name,
+                        "checksum": checksum,
+                        "display_name": meta.get("display_name", script_name),
+                        "schedule": meta.get("schedule", "every 24 hours"),
+                        # Strip header comments, keep only the actual SQL
+                        "body_sql": _strip_leading_comments(sql),
+                    })
+                else:
+                    _run_one(client, project, dataset, version, script_name, checksum, sql)
+
+        _deploy_schedules(client, project, dataset, location, scheduled)
+    except BaseException:
+        # Migrations that already ran must reach the control table even when
+        # the run aborts outside _run_one's own handler (unreadable file,
+        # Ctrl-C, ...) — otherwise the next run would re-execute them.
+        # Best-effort: never mask the original error with a flush failure.
+        try:
+            flush_migration_records(client, project, dataset)
+        except Exception:  # noqa: BLE001
+            pass
+        raise
 
-        with open(file_path, "r", encoding="utf-8") as fh:
-            raw_sql = fh.read()
+    flush_migration_records(client, project, dataset)
+    _checksum_cache_save(cache)
 
-        checksum = sha256(raw_sql)
-        sql = substitute_placeholders(raw_sql, project, dataset)
 
-        try:
-            if is_scheduled(raw_sql):
-                meta = parse_scheduled_metadata(raw_sql)
-                display_name = meta.get("display_name", script_name)
-                schedule = meta.get("schedule", "every 24 hours")
-                # Strip header comments, keep only the actual SQL
-                body_lines = [
-                    line for line in sql.splitlines()
-                    if not line.strip().startswith("--")
-                ]
-                body_sql = "\n".join(body_lines).strip()
-                start = time.monotonic()
-                deploy_scheduled_query(project, dataset, location, display_name, schedule, body_sql, script_name)
-                elapsed_ms = int((time.monotonic() - start) * 1000)
-            else:
-                elapsed_ms = run_sql(client, sql, script_name)
-
-            record_migration(client, project, dataset, version, script_name, checksum, elapsed_ms, True)
-            click.secho(f"  ✓ {script_name} ({elapsed_ms}ms)", fg="green")
-
-        except Exception as exc:  # noqa: BLE001
-            record_migration(client, project, dataset, version, script_name, checksum, 0, False)
-            click.secho(f"\n✗ Migration failed: {script_name}", fg="red", err=True)
-            click.secho(f"  {exc}", fg="red", err=True)
-            raise SystemExit(1) from exc
+def _run_one(
+    client: bigquery.Client,
+    project: str,
+    dataset: str,
+    version: str,
+    script_name: str,
+    checksum: str,
+    sql: str,
+) -> None:
+    """Execute a single migration script and record the outcome."""
+    try:
+        elapsed_ms = run_sql(client, sql, script_name)
+        record_migration(version, script_name, checksum, elapsed_ms, True)
+        click.secho(f"  ✓ {script_name} ({elapsed_ms}ms)", fg="green")
+
+    except Exception as exc:  # noqa: BLE001
+        # Flush what ran (including this failure) so the control table is accurate.
+        record_migration(version, script_name, checksum, 0, False)
+        flush_migration_records(client, project, dataset)
+        click.secho(f"\n✗ Migration failed: {script_name}", fg="red", err=True)
+        click.secho(f"  {exc}", fg="red", err=True)
+        raise SystemExit(1) from exc
+
+
+def _deploy_schedules(
+    client: bigquery.Client,
+    project: str,
+    dataset: str,
+    location: str,
+    scheduled: list[dict],
+) -> None:
+    """Deploy all pending scheduled queries concurrently over one client.
+
+    Each create_transfer_config call is a blocking unary RPC, so N
+    deployments cost N round-trips when serialized. Fanning out over a
+    thread pool bounds the phase at roughly one round-trip.
+    """
+    if not scheduled:
+        return
+
+    from google.cloud import bigquery_datatransfer_v1
+
+    dt_client = bigquery_datatransfer_v1.DataTransferServiceClient(credentials=get_credentials())
+
+    def _deploy(item: dict) -> int:
+        start = time.monotonic()
+        deploy_scheduled_query(
+            dt_client, project, dataset, location,
+            item["display_name"], item["schedule"], item["body_sql"], item["script_name"],
+        )
+        return int((time.monotonic() - start) * 1000)
+
+    failed = None
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [(item, pool.submit(_deploy, item)) for item in scheduled]
+        for item, future in futures:
+            try:
+                elapsed_ms = future.result()
+                record_migration(item["version"], item["script_name"], item["checksum"], elapsed_ms, True)
+                click.secho(f"  ✓ {item['script_name']} ({elapsed_ms}ms)", fg="green")
+            except Exception as exc:  # noqa: BLE001
+                record_migration(item["version"], item["script_name"], item["checksum"], 0, False)
+                click.secho(f"\n✗ Scheduled query failed: {item['script_name']}", fg="red", err=True)
+                click.secho(f"  {exc}", fg="red", err=True)
+                failed = exc
+
+    if failed is not None:
+        flush_migration_records(client, project, dataset)
+        raise SystemExit(1) from failed
 
 
 def show_status(client: bigquery.Client, project: str, dataset: str) -> None:
     ensure_control_table(client, project, dataset)
-    executed = get_executed_versions(client, project, dataset)
 
     sql = f"""
         SELECT version, script_name, executed_at, execution_time_ms, success
         FROM `{project}.{dataset}.{CONTROL_TABLE}`
         ORDER BY version
     """
-    rows = list(client.query(sql).result())
-    executed_map = {row.version: row for row in rows}
+    # The control-table query and the filesystem walk are independent —
+    # overlap the BigQuery round-trip with the local directory scan. Rows
+    # stream straight into the map (paged) with no intermediate list.
+    def _fetch_executed_map() -> dict:
+        return {row.version: row for row in client.query(sql).result(page_size=1000)}
 
-    files = collect_migration_files()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        map_future = pool.submit(_fetch_executed_map)
+        files = collect_migration_files()
+    executed_map = map_future.result()
 
     click.echo(f"\n{'VERSION':<12} {'STATUS':<12} {'SCRIPT':<50} {'EXECUTED AT'}")
     click.echo("-" * 100)
@@ -323,8 +604,11 @@ def main(project: str, dataset: str, location: str, dry_run: bool, status: bool)
       python migrate.py --project my-project --dataset my_dataset --location us-east1
     """
 
-    load_credentials()
-    client = bigquery.Client(project=project)
+    client = None
+    if status or not dry_run:
+        from google.cloud import bigquery
+
+        client = bigquery.Client(project=project, credentials=get_credentials())
 
     click.echo(f"BigQuery Schema Migrator")
     click.echo(f"Target: {project}.{dataset} | Location: {location}")
@@ -341,4 +625,8 @@ def main(project: str, dataset: str, location: str, dry_run: bool, status: bool)
 
 
 if __name__ == "__main__":
+    # Load .env before click parses options (env-var defaults depend on it).
+    from dotenv import load_dotenv
+
+    load_dotenv()
     main()
@@ -6,7 +6,8 @@ Run with: pytest
 """
 
 import os
-import json
+from contextlib import contextmanager
+
 import pytest
 
 from migrate import (
@@ -15,7 +16,9 @@ from migrate import (
     substitute_placeholders,
     is_scheduled,
     parse_scheduled_metadata,
+    _strip_leading_comments,
 )
+import credentials
 from credentials import load_credentials
 
 
@@ -23,47 +26,46 @@ from credentials import load_credentials
 # sha256
 # ---------------------------------------------------------------------------
 
-class TestSha256:
-    def test_returns_string(self):
-        result = sha256("hello")
-        assert isinstance(result, str)
+# Computed once at import so the determinism check below hashes only once.
+_SHA_ABC = sha256("abc")
+
 
-    def test_known_hash(self):
+class TestSha256:
+    @pytest.mark.parametrize("content,expected", [
         # echo -n "hello" | sha256sum → 2cf24dba...
-        assert sha256("hello") == "2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824"
+        ("hello", "2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824"),
+        ("", "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"),
+    ])
+    def test_known_hash(self, content, expected):
+        assert sha256(content) == expected
 
     def test_same_input_same_output(self):
-        assert sha256("abc") == sha256("abc")
+        assert sha256("abc") == _SHA_ABC
 
     def test_different_inputs_different_hashes(self):
         assert sha256("foo") != sha256("bar")
 
-    def test_empty_string(self):
-        result = sha256("")
-        assert len(result) == 64  # SHA-256 is always 64 hex chars
-
 
 # ---------------------------------------------------------------------------
 # extract_version
 # ---------------------------------------------------------------------------
 
 class TestExtractVersion:
-    def test_basic(self):
-        assert extract_version("V00001_create_table_orders.sql") == "V00001"
-
-    def test_full_path(self):
-        assert extract_version("migrations/V00042_add_column_foo.sql") == "V00042"
-
-    def test_high_version_number(self):
-        assert extract_version("V99999_some_migration.sql") == "V99999"
-
-    def test_invalid_format_raises(self):
+    @pytest.mark.parametrize("filename,expected", [
+        ("V00001_create_table_orders.sql", "V00001"),
+        ("migrations/V00042_add_column_foo.sql", "V00042"),
+        ("V99999_some_migration.sql", "V99999"),
+    ])
+    def test_valid_filenames(self, filename, expected):
+        assert extract_version(filename) == expected
+
+    @pytest.mark.parametrize("filename", [
+        "create_table.sql",
+        "00001_create_table.sql",
+    ])
+    def test_invalid_filenames_raise(self, filename):
         with pytest.raises(ValueError, match="Invalid migration filename"):
-            extract_version("create_table.sql")
-
-    def test_missing_v_prefix_raises(self):
-        with pytest.raises(ValueError, match="Invalid migration filename"):
-            extract_version("00001_create_table.sql")
+            extract_version(filename)
 
 
 # ---------------------------------------------------------------------------
@@ -71,31 +73,15 @@ class TestExtractVersion:
 # ---------------------------------------------------------------------------
 
 class TestSubstitutePlaceholders:
-    def test_replaces_project(self):
-        sql = "SELECT * FROM `${PROJECT}.dataset.table`"
-        result = substitute_placeholders(sql, project="my-project", dataset="my_dataset")
-        assert "my-project" in result
-        assert "${PROJECT}" not in result
-
-    def test_replaces_dataset(self):
-        sql = "SELECT * FROM `project.${DATASET}.table`"
-        result = substitute_placeholders(sql, project="proj", dataset="ds")
-        assert "ds" in result
-        assert "${DATASET}" not in result
-
-    def test_replaces_both(self):
-        sql = "CREATE TABLE `${PROJECT}.${DATASET}.orders` (id STRING);"
-        result = substitute_placeholders(sql, project="p", dataset="d")
-        assert result == "CREATE TABLE `p.d.orders` (id STRING);"
-
-    def test_no_placeholders(self):
-        sql = "SELECT 1"
-        assert substitute_placeholders(sql, project="p", dataset="d") == "SELECT 1"
-
-    def test_multiple_occurrences(self):
-        sql = "${PROJECT} and ${PROJECT}"
-        result = substitute_placeholders(sql, project="x", dataset="y")
-        assert result == "x and x"
+    @pytest.mark.parametrize("sql,expected", [
+        ("SELECT * FROM `${PROJECT}.dataset.table`", "SELECT * FROM `p.dataset.table`"),
+        ("SELECT * FROM `project.${DATASET}.table`", "SELECT * FROM `project.d.table`"),
+        ("CREATE TABLE `${PROJECT}.${DATASET}.orders` (id STRING);", "CREATE TABLE `p.d.orders` (id STRING);"),
+        ("SELECT 1", "SELECT 1"),
+        ("${PROJECT} and ${PROJECT}", "p and p"),
+    ])
+    def test_substitution(self, sql, expected):
+        assert substitute_placeholders(sql, project="p", dataset="d") == expected
 
 
 # ---------------------------------------------------------------------------
@@ -124,73 +110,115 @@ class TestIsScheduled:
 # parse_scheduled_metadata
 # ---------------------------------------------------------------------------
 
+FULL_HEADER = (
+    "-- @scheduled\n"
+    "-- @display_name: compaction_orders\n"
+    "-- @schedule: every day 03:00\n"
+    "-- @description: Remove duplicates\n"
+    "\n"
+    "DELETE FROM `project.dataset.orders` WHERE 1=1;"
+)
+
+
+@pytest.fixture(scope="class")
+def parsed_meta():
+    """Parse FULL_HEADER once per class — the function is pure."""
+    return parse_scheduled_metadata(FULL_HEADER)
+
+
 class TestParseScheduledMetadata:
-    FULL_HEADER = (
-        "-- @scheduled\n"
-        "-- @display_name: compaction_orders\n"
-        "-- @schedule: every day 03:00\n"
-        "-- @description: Remove duplicates\n"
-        "\n"
-        "DELETE FROM `project.dataset.orders` WHERE 1=1;"
-    )
-
-    def test_parses_display_name(self):
-        meta = parse_scheduled_metadata(self.FULL_HEADER)
-        assert meta["display_name"] == "compaction_orders"
-
-    def test_parses_schedule(self):
-        meta = parse_scheduled_metadata(self.FULL_HEADER)
-        assert meta["schedule"] == "every day 03:00"
-
-    def test_parses_description(self):
-        meta = parse_scheduled_metadata(self.FULL_HEADER)
-        assert meta["description"] == "Remove duplicates"
-
-    def test_ignores_sql_body(self):
-        meta = parse_scheduled_metadata(self.FULL_HEADER)
-        assert "DELETE" not in str(meta)
+    def test_parses_display_name(self, parsed_meta):
+        assert parsed_meta["display_name"] == "compaction_orders"
+
+    def test_parses_schedule(self, parsed_meta):
+        assert parsed_meta["schedule"] == "every day 03:00"
+
+    def test_parses_description(self, parsed_meta):
+        assert parsed_meta["description"] == "Remove duplicates"
+
+    def test_ignores_sql_body(self, parsed_meta):
+        assert "DELETE" not in str(parsed_meta)
 
     def test_empty_header(self):
         meta = parse_scheduled_metadata("SELECT 1;")
         assert meta == {}
 
 
+# ---------------------------------------------------------------------------
+# _strip_leading_comments
+# ---------------------------------------------------------------------------
+
+class TestStripLeadingComments:
+    def test_strips_header_block(self):
+        sql = "-- @scheduled\n-- @schedule: every day 03:00\nSELECT 1;"
+        assert _strip_leading_comments(sql) == "SELECT 1;"
+
+    def test_strips_blank_lines_between_comments(self):
+        sql = "-- header\n\n-- more header\n\nDELETE FROM t;"
+        assert _strip_leading_comments(sql) == "DELETE FROM t;"
+
+    def test_no_comments_returns_body(self):
+        assert _strip_leading_comments("SELECT 1;") == "SELECT 1;"
+
+    def test_only_comments_returns_empty(self):
+        assert _strip_leading_comments("-- just a comment\n-- another") == ""
+
+
 # ---------------------------------------------------------------------------
 # credentials.load_credentials
 # ---------------------------------------------------------------------------
 
-class TestLoadCredentials:
-    def test_respects_existing_env_var(self, tmp_path, monkeypatch):
-        key_file = tmp_path / "sa_key.json"
-        key_file.write_text("{}")
-        monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", str(key_file))
-        result = load_credentials()
-        assert result == str(key_file)
+class _FakeDirEntry:
+    """Minimal stand-in for os.DirEntry as used by load_credentials."""
+
+    def __init__(self, name):
+        self.name = name
+        self.path = os.path.join("credentials", name)
 
-    def test_auto_discovers_single_json(self, tmp_path, monkeypatch):
+    def is_file(self):
+        return True
+
+
+@pytest.fixture
+def fake_creds_dir(monkeypatch):
+    """In-memory credentials/ directory: stubs os.scandir so the discovery
+    tests never touch the real filesystem. Append file names to the
+    returned list to populate the fake directory."""
+    names = []
+
+    @contextmanager
+    def _scandir(path):
+        assert path == "credentials"
+        yield [_FakeDirEntry(n) for n in names]
+
+    monkeypatch.setattr(os, "scandir", _scandir)
+    return names
+
+
+class TestLoadCredentials:
+    @pytest.fixture(autouse=True)
+    def _clean_creds(self, monkeypatch):
+        # One shared preamble: clear the per-process path memo and the env
+        # var so every test starts from an unresolved state. Tests that
+        # need the env var set it after this runs; monkeypatch restores
+        # everything on teardown.
+        monkeypatch.setattr(credentials, "_RESOLVED_PATH", None)
         monkeypatch.delenv("GOOGLE_APPLICATION_CREDENTIALS", raising=False)
-        # Point credentials/ to our tmp dir
-        key_file = tmp_path / "sa.json"
-        key_file.write_text(json.dumps({"type": "service_account"}))
-        monkeypatch.chdir(tmp_path)
-        (tmp_path / "credentials").mkdir()
-        (tmp_path / "credentials" / "sa.json").write_text("{}")
+
+    def test_respects_existing_env_var(self, monkeypatch):
+        monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", "/keys/sa_key.json")
+        assert load_credentials() == "/keys/sa_key.json"
+
+    def test_auto_discovers_single_json(self, fake_creds_dir):
+        fake_creds_dir.append("sa.json")
         result = load_credentials()
         assert result.endswith("sa.json")
 
-    def test_raises_when_no_credentials(self, tmp_path, monkeypatch):
-        monkeypatch.delenv("GOOGLE_APPLICATION_CREDENTIALS", raising=False)
-        monkeypatch.chdir(tmp_path)
-        (tmp_path / "credentials").mkdir()
+    def test_raises_when_no_credentials(self, fake_creds_dir):
         with pytest.raises(RuntimeError, match="No Service Account key found"):
             load_credentials()
 
-    def test_raises_when_multiple_json_files(self, tmp_path, monkeypatch):
-        monkeypatch.delenv("GOOGLE_APPLICATION_CREDENTIALS", raising=False)
-        monkeypatch.chdir(tmp_path)
-        creds_dir = tmp_path / "credentials"
-        creds_dir.mkdir()
-        (creds_dir / "key1.json").write_text("{}")
-        (creds_dir / "key2.json").write_text("{}")
+    def test_raises_when_multiple_json_files(self, fake_creds_dir):
+        fake_creds_dir.extend(["key1.json", "key2.json"])
         with pytest.raises(RuntimeError, match="Multiple JSON files"):
             load_credentials()